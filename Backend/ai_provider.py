@@ -1,11 +1,197 @@
 
-import json
+import asyncio
+import functools
+import hashlib
+import logging
 import re
+import threading
+from collections import OrderedDict
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Final, Optional, Tuple
 import google.generativeai as genai
+import orjson
 
 from config import config
+from image_encoder import encode_image_jpeg
+from process_pool import run_in_process_pool
+from result_validator import ResultValidator
+
+logger = logging.getLogger(__name__)
+
+# Használt Gemini modell (a válasz cache kulcsának is része)
+_MODEL_NAME = "gemini-2.0-flash-exp"
+
+# Válasz cache kulcs verzió - növelni kell ha a cache-elt formátum változik
+_RESPONSE_CACHE_VERSION = b"v1"
+
+# Markdown kód blokk (```json ... ``` vagy ``` ... ```) belsejének kinyerése
+_FENCE_RE = re.compile(r'^\s*```(?:json)?\s*(.*?)\s*```\s*$', re.DOTALL)
+
+# Nyitó markdown fence (streamelés közben a lezáró még nem érkezett meg)
+_OPENING_FENCE_RE = re.compile(r'^\s*```(?:json)?')
+
+# Tartalék minta: a válaszba ágyazott (akár beágyazott) JSON objektum
+_JSON_OBJECT_RE = re.compile(r'\{.*\}', re.DOTALL)
+
+# Tápérték szekció jelölők prioritási sorrendben: előbb a táblázat fejlécek,
+# utána tartalékként az "Energy"/"Energia" sor (ott kontextussal vágunk)
+_SECTION_MARKERS: Final = (
+    "Nutritional information",
+    "Tápérték adatok",
+    "Nutrition facts",
+    "Energy/Energia",
+)
+_ENERGY_MARKERS: Final = ("Energy", "Energia")
+_ALL_MARKERS: Final = _SECTION_MARKERS + _ENERGY_MARKERS
+_SECTION_MARKER_COUNT: Final = len(_SECTION_MARKERS)
+_MAX_MARKER_LENGTH: Final = max(len(marker) for marker in _ALL_MARKERS)
+# Egyetlen alternációs minta - egy menetben találja meg az összes jelölőt,
+# minden jelölő saját csoportban (csoportindex - 1 = prioritás)
+_SECTION_MARKER_RE: Final = re.compile("|".join(f"({re.escape(marker)})" for marker in _ALL_MARKERS))
+
+# Folyamatszintű szolgáltató példány (lásd get_ai_provider)
+_PROVIDER_SINGLETON: Optional["GeminiProvider"] = None
+_PROVIDER_LOCK = threading.Lock()
+
+
+@functools.lru_cache(maxsize=1)
+def _load_prompt() -> str:
+    """Prompt betöltése külső fájlból (egyszer, utána cache-ből)."""
+    prompt_path = Path(__file__).parent / "prompt.txt"
+    with open(prompt_path, 'r', encoding='utf-8') as f:
+        return f.read()
+
+
+def _find_best_marker(text: str, pos: int, endpos: int) -> Tuple[int, int]:
+    """
+    Jelölők keresése a text[pos:endpos] ablakban egyetlen menetben (másolás nélkül).
+    
+    A legmagasabb prioritású jelölő első előfordulása nyer; a prioritás a
+    találat csoportindexéből jön (nincs részstring allokáció).
+    
+    Kimenet:
+        (prioritás, pozíció) - pozíció -1 ha nincs találat
+    """
+    best_priority: int = len(_ALL_MARKERS)
+    best_idx: int = -1
+    for match in _SECTION_MARKER_RE.finditer(text, pos, endpos):
+        priority: int = match.lastindex - 1
+        if priority < best_priority:
+            best_priority = priority
+            best_idx = match.start()
+            if priority == 0:
+                break
+    return best_priority, best_idx
+
+
+def _extract_nutrition_section(text: str) -> str:
+    """
+    Tápértéktáblázat szekció kinyerése a teljes dokumentum szövegből.
+    Ez segíti a Gemini-t hogy a releváns részre fókuszáljon, ne vesszen el a 6000+ karakterben.
+    """
+    # A tápértéktáblázat a címkéken jellemzően a dokumentum második felében
+    # van, ezért először ott keresünk. A prioritási sorrend szigorú marad:
+    # az első felet akkor is átnézzük (a határon átlógó jelölők miatt kis
+    # átfedéssel), ha ott magasabb prioritású jelölő lehet - pl. egy fejléc
+    # az első félben mindig megelőzi a második fél puszta "Energy" találatát.
+    # Azonos prioritásnál a második félbeli előfordulás nyer.
+    tail_start = max(0, len(text) // 2 - _MAX_MARKER_LENGTH)
+    best_priority, best_idx = _find_best_marker(text, tail_start, len(text))
+    if best_priority > 0:
+        head_priority, head_idx = _find_best_marker(text, 0, tail_start + _MAX_MARKER_LENGTH)
+        if head_priority < best_priority:
+            best_priority, best_idx = head_priority, head_idx
+    
+    if best_idx != -1:
+        marker = _ALL_MARKERS[best_priority]
+        if best_priority < _SECTION_MARKER_COUNT:
+            # Megtaláltuk! Kinyerjük innen + következő 400 karakter (elég a táblázathoz)
+            section = text[best_idx:best_idx+400]
+            logger.debug("'%s' megtalálva %d. pozíción", marker, best_idx)
+            return section
+        
+        # Tartalék: "Energy" vagy "Energia", aminek a táblázatban kell lennie
+        # 50 karakterrel előtte és 350-nel utána hogy az egész táblázatot megkapjuk
+        start = max(0, best_idx - 50)
+        section = text[start:best_idx+350]
+        logger.debug("'%s' megtalálva %d. pozíción (kontextussal)", marker, best_idx)
+        return section
+    
+    # Végső megoldás: üres visszaadása, Gemini a teljes szöveggel dolgozik
+    logger.debug("Nincs tápérték szekció, teljes szöveg használata")
+    return ""
+
+
+class ResponseCache:
+    """
+    Tartalom-címzett LRU cache a Gemini válaszokhoz.
+    
+    A kulcs a (cache verzió, modell, prompt, dokumentum szöveg) SHA-256 hash-e,
+    így ugyanazon PDF újrafeltöltése nem indít új API hívást. Csak a sémának
+    megfelelő válasz kerül be, így egy hibás válasz nem ismétlődik újraküldéskor.
+    """
+    
+    def __init__(self, max_entries: int = 128):
+        """
+        Paraméterek:
+            max_entries: Maximálisan tárolt válaszok száma (0 = kikapcsolva)
+        """
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[bytes, bytes]" = OrderedDict()
+        self._lock = asyncio.Lock()
+    
+    @staticmethod
+    def make_key(prompt: str, text: str) -> bytes:
+        """
+        Cache kulcs számítása.
+        
+        A prompt és a szöveg elé 8 bájtos hossz kerül, így a két mező
+        határa nem csúszhat el (nincs ütközés az összefűzésből).
+        """
+        prompt_bytes = prompt.encode("utf-8")
+        text_bytes = text.encode("utf-8")
+        
+        hasher = hashlib.sha256()
+        hasher.update(_RESPONSE_CACHE_VERSION + b"|" + _MODEL_NAME.encode("ascii") + b"|")
+        hasher.update(len(prompt_bytes).to_bytes(8, "little"))
+        hasher.update(prompt_bytes)
+        hasher.update(len(text_bytes).to_bytes(8, "little"))
+        hasher.update(text_bytes)
+        return hasher.digest()
+    
+    async def get(self, key: bytes) -> Optional[Dict[str, Any]]:
+        """Cache-elt eredmény lekérése (mindig új dict példány)."""
+        async with self._lock:
+            payload = self._entries.get(key)
+            if payload is None:
+                return None
+            self._entries.move_to_end(key)
+        
+        result = orjson.loads(payload)
+        # Csak az aktuális sémának megfelelő bejegyzést adjuk vissza
+        if not ResultValidator.is_valid(result):
+            async with self._lock:
+                if self._entries.get(key) is payload:
+                    del self._entries[key]
+            return None
+        return result
+    
+    async def put(self, key: bytes, result: Dict[str, Any]) -> None:
+        """
+        Eredmény eltárolása, a legrégebben használt bejegyzés kiszorításával.
+        
+        A sémának nem megfelelő válasz nem kerül be (a validálás később
+        hibát ad rá, és az újrapróbálásnak új Gemini hívást kell indítania).
+        """
+        if self.max_entries <= 0 or not ResultValidator.is_valid(result):
+            return
+        
+        payload = orjson.dumps(result)
+        async with self._lock:
+            self._entries[key] = payload
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
 
 
 class GeminiProvider:
@@ -13,20 +199,56 @@ class GeminiProvider:
     
     def __init__(self):
         # API kulcs konfigurálása a config fájlból
+        # (az SDK az async gRPC klienst ez alapján egyszer hozza létre és
+        # cache-eli, így minden hívás ugyanazt a HTTP/2 csatornát használja -
+        # ezért is fontos, hogy a szolgáltató singleton legyen)
         genai.configure(api_key=config.GEMINI_API_KEY)
         
         # Gemini modell inicializálása
         self.model = genai.GenerativeModel(
-            "gemini-2.0-flash-exp",  # Legújabb gyors modell
+            _MODEL_NAME,  # Legújabb gyors modell
             generation_config={
                 "temperature": 0.1,  # Alacsony temperature a konzisztens válaszokhoz
                 "max_output_tokens": 2048  # Maximális válasz hossz
             }
         )
         # Prompt betöltése külső fájlból
-        prompt_path = Path(__file__).parent / "prompt.txt"
-        with open(prompt_path, 'r', encoding='utf-8') as f:
-            self.prompt = f.read()
+        self.prompt = _load_prompt()
+        
+        # A kérésenként összeállított promptok statikus részei (egyszer készülnek el)
+        self._section_prompt_parts = (
+            f"""{self.prompt}
+
+TELJES DOKUMENTUM (allergének és kontextus):
+""",
+            """
+
+TÁPÉRTÉKTÁBLÁZAT (fókuszált kinyerés):
+""",
+            """
+
+Vond ki a tápértékeket a TÁPÉRTÉKTÁBLÁZAT szekcióból és az allergéneket a TELJES DOKUMENTUMBÓL.
+Csak a JSON-t add vissza."""
+        )
+        self._document_prompt_parts = (
+            f"""{self.prompt}
+
+ELEMZENDŐ DOKUMENTUM:
+""",
+            """
+
+Vond ki az adatokat a fent mutatott formátumban. Csak a JSON-t add vissza."""
+        )
+        self._vision_prompt = f"""{self.prompt}
+
+UTASÍTÁSOK:
+Egy termék címkéjének vagy dokumentumának képeit látod.
+Vizuálisan azonosítsd és vond ki a tápértéktáblázatot és az allergén listát.
+NE használj OCR szöveget - elemezd közvetlenül a képet.
+Csak a JSON-t add vissza a fent megadott pontos formátumban."""
+        
+        # Azonos dokumentumokra adott válaszok cache-e
+        self.response_cache = ResponseCache(max_entries=config.RESPONSE_CACHE_SIZE)
     
     def _get_prompt(self) -> str:
         return self.prompt
@@ -42,62 +264,75 @@ class GeminiProvider:
             Feldolgozott JSON dictionary
         """
         # Markdown kód blokkok eltávolítása ha vannak
-        response_text = response_text.strip()
-        
-        if response_text.startswith("```json"):
-            response_text = response_text[7:]
-        elif response_text.startswith("```"):
-            response_text = response_text[3:]
-        
-        if response_text.endswith("```"):
-            response_text = response_text[:-3]
-        
-        response_text = response_text.strip()
+        fence_match = _FENCE_RE.match(response_text)
+        response_text = fence_match.group(1) if fence_match else response_text.strip()
         
         try:
-            return json.loads(response_text)
-        except json.JSONDecodeError as e:
+            return orjson.loads(response_text)
+        except orjson.JSONDecodeError as e:
             # JSON keresése a válaszban regex-szel
-            json_match = re.search(r'\{[^}]+\}', response_text, re.DOTALL)
+            json_match = _JSON_OBJECT_RE.search(response_text)
             if json_match:
-                return json.loads(json_match.group())
+                try:
+                    return orjson.loads(json_match.group())
+                except orjson.JSONDecodeError:
+                    pass
             raise ValueError(f"Nem sikerült a JSON feldolgozása: {e}")
     
-    def _extract_nutrition_section(self, text: str) -> str:
+    async def _generate_json(self, contents: Any) -> Dict[str, Any]:
         """
-        Tápértéktáblázat szekció kinyerése a teljes dokumentum szövegből.
-        Ez segíti a Gemini-t hogy a releváns részre fókuszáljon, ne vesszen el a 6000+ karakterben.
+        Gemini válasz streamelése és feldolgozása.
+        
+        A darabok érkezése közben, amint a puffer egy teljes JSON objektumot
+        tartalmaz, a stream olvasása leáll (a lezáró fence-re és az esetleges
+        utószövegre nem várunk). Hibás stream esetén a teljes szöveg a
+        _parse_json_response tartalék útvonalára kerül.
+        
+        Korlátok: a leállás csak az olvasást hagyja abba, a gRPC streamet
+        nem szakítja meg (az SDK nem ad rá nyilvános API-t), így a szerver a
+        választ végiggenerálhatja és a tokenek számlázódnak. Az SDK
+        (google-generativeai 0.8.x) iterátora egy darabbal előre olvas, ezért
+        a korai leállás legfeljebb a JSON utáni darabok megvárását spórolja
+        meg - a válaszidő érdemben nem csökken.
+        
+        Bemenet:
+            contents: Prompt vagy prompt + kép részek listája
+            
+        Kimenet:
+            Feldolgozott JSON dictionary
         """
-        # Tápérték szekció keresése különböző mintákkal
-        # Egyszerű string keresés használata
-        markers = [
-            "Nutritional information",
-            "Tápérték adatok",
-            "Nutrition facts",
-            "Energy/Energia"
-        ]
-        
-        for marker in markers:
-            idx = text.find(marker)
-            if idx != -1:
-                # Megtaláltuk! Kinyerjük innen + következő 400 karakter (elég a táblázathoz)
-                section = text[idx:idx+400]
-                print(f"'{marker}' megtalálva {idx}. pozíción")
-                return section
-        
-        # Tartalék: keresés "Energy" vagy "Energia" után, aminek a táblázatban kell lennie
-        for energy_marker in ["Energy", "Energia"]:
-            idx = text.find(energy_marker)
-            if idx != -1:
-                # 50 karakterrel előtte és 350-nel utána hogy az egész táblázatot megkapjuk
-                start = max(0, idx - 50)
-                section = text[start:idx+350]
-                print(f"  → '{energy_marker}' megtalálva {idx}. pozíción (kontextussal)")
-                return section
-        
-        # Végső megoldás: üres visszaadása, Gemini a teljes szöveggel dolgozik
-        print("Nincs tápérték szekció, teljes szöveg használata")
-        return ""
+        response = await self.model.generate_content_async(contents, stream=True)
+        
+        chunks = []
+        result = None
+        async for chunk in response:
+            if not chunk.parts:
+                continue
+            chunks.append(chunk.text)
+            
+            # Csak akkor próbálkozunk, ha a puffer objektum lezárással végződik
+            buffered = "".join(chunks).strip()
+            fence_match = _FENCE_RE.match(buffered)
+            payload = fence_match.group(1) if fence_match else _OPENING_FENCE_RE.sub("", buffered, count=1).strip()
+            if not payload.endswith("}"):
+                continue
+            try:
+                result = orjson.loads(payload)
+            except orjson.JSONDecodeError:
+                continue
+            if isinstance(result, dict):
+                break
+            result = None
+        
+        response_text = "".join(chunks)
+        
+        # Debug: nyers válasz naplózása (csak ha a DEBUG szint aktív)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Gemini válasz: %s", response_text[:1500])
+        
+        if result is None:
+            result = self._parse_json_response(response_text)
+        return result
     
     async def analyze_pdf(
         self,
@@ -109,40 +344,32 @@ class GeminiProvider:
         """PDF elemzése Gemini-vel (szöveg alapú kinyerés)."""
         prompt = self._get_prompt()
         
+        # Azonos prompt + szöveg esetén a korábbi válasz újrahasznosítása
+        cache_key = ResponseCache.make_key(prompt, text)
+        cached_result = await self.response_cache.get(cache_key)
+        if cached_result is not None:
+            logger.info("Gemini válasz a cache-ből")
+            return cached_result
+        
         # OPTIMALIZÁLÁS: Tápérték szekció kinyerése a zaj csökkentésére
-        nutrition_section = self._extract_nutrition_section(text)
+        nutrition_section = _extract_nutrition_section(text)
         
-        print(nutrition_section[:500])
-       
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Tápérték szekció: %s", nutrition_section[:500])
         
-        # Promptok kombinálása Gemini számára
+        # Promptok kombinálása Gemini számára az előre összeállított statikus részekből
         if nutrition_section:
             # Megtaláltuk a tápérték szekciót - mindkettőt küldjük kontextusnak
-            full_prompt = f"""{prompt}
-
-TELJES DOKUMENTUM (allergének és kontextus):
-{text}
-
-TÁPÉRTÉKTÁBLÁZAT (fókuszált kinyerés):
-{nutrition_section}
-
-Vond ki a tápértékeket a TÁPÉRTÉKTÁBLÁZAT szekcióból és az allergéneket a TELJES DOKUMENTUMBÓL.
-Csak a JSON-t add vissza."""
+            prefix, middle, suffix = self._section_prompt_parts
+            full_prompt = "".join((prefix, text, middle, nutrition_section, suffix))
         else:
             # Nincs szekció, teljes szöveget küldjük
-            full_prompt = f"""{prompt}
-
-ELEMZENDŐ DOKUMENTUM:
-{text}
-
-Vond ki az adatokat a fent mutatott formátumban. Csak a JSON-t add vissza."""
-        
-        response = await self.model.generate_content_async(full_prompt)
+            prefix, suffix = self._document_prompt_parts
+            full_prompt = "".join((prefix, text, suffix))
         
-        # Debug: nyers válasz kiírása (több karakter)
-        print(response.text[:1500])  # Növelve 1500 karakterre
-        
-        return self._parse_json_response(response.text)
+        result = await self._generate_json(full_prompt)
+        await self.response_cache.put(cache_key, result)
+        return result
     
     async def analyze_pdf_with_vision(
         self,
@@ -155,57 +382,48 @@ Vond ki az adatokat a fent mutatott formátumban. Csak a JSON-t add vissza."""
         Ez egy fallback amikor az OCR hibás vagy rossz eredményt ad.
         
         Bemenet:
-            images: PIL Image objektumok listája (PDF oldalak)
+            images: PIL Image objektumok vagy képfájl útvonalak listája (PDF oldalak)
             language: Észlelt nyelv hint
             metadata: További metaadatok
             
         Kimenet:
             Feldolgozott JSON tápérték és allergén adatokkal
         """
-        prompt = self._get_prompt()
+        logger.info("%d oldal elemzése Vision API-val", len(images))
         
-        print(f"{len(images)} oldal elemzése Vision API-val")
+        # Képek konvertálása Gemini által elfogadott formátumra
+        content_parts = [self._vision_prompt]
         
-        # Vision prompt előkészítése
-        vision_prompt = f"""{prompt}
-
-UTASÍTÁSOK:
-Egy termék címkéjének vagy dokumentumának képeit látod.
-Vizuálisan azonosítsd és vond ki a tápértéktáblázatot és az allergén listát.
-NE használj OCR szöveget - elemezd közvetlenül a képet.
-Csak a JSON-t add vissza a fent megadott pontos formátumban."""
-        
-        # PIL képek konvertálása Gemini által elfogadott formátumra
-        content_parts = [vision_prompt]
+        # Oldalak kódolása párhuzamosan, a közös folyamat poolban (a GIL megkerülésével)
+        encoded_pages = await asyncio.gather(
+            *(run_in_process_pool(encode_image_jpeg, img) for img in images)
+        )
         
-        for idx, img in enumerate(images):
-            # PIL kép konvertálása byte-okká
-            import io
-            img_byte_arr = io.BytesIO()
-            img.save(img_byte_arr, format='PNG')
-            img_byte_arr.seek(0)
-            
+        for data in encoded_pages:
             content_parts.append({
-                "mime_type": "image/png",
-                "data": img_byte_arr.read()
+                "mime_type": "image/jpeg",
+                "data": data
             })
-            
-            print(f"{idx + 1}. oldal hozzáadva képként")
         
         # Küldés Gemini Vision-nek
-        response = await self.model.generate_content_async(content_parts)
-        
-        print(response.text[:1500])
-
-        return self._parse_json_response(response.text)
+        return await self._generate_json(content_parts)
 
 
 def get_ai_provider() -> GeminiProvider:
     """
     Gemini AI szolgáltató példány lekérése.
     
+    A szolgáltató (és vele a GenerativeModel) egyszer jön létre, utána
+    minden kérés ugyanazt a példányt kapja.
+    
     Kimenet:
         GeminiProvider példány
     """
-    return GeminiProvider()
+    global _PROVIDER_SINGLETON
+    
+    if _PROVIDER_SINGLETON is None:
+        with _PROVIDER_LOCK:
+            if _PROVIDER_SINGLETON is None:
+                _PROVIDER_SINGLETON = GeminiProvider()
+    return _PROVIDER_SINGLETON
 
@@ -2,12 +2,23 @@
 Konfigurációs modul a Backend szolgáltatáshoz.
 Betölti a környezeti változókat és központosított konfigurációt biztosít.
 """
+import logging
 import os
 from dotenv import load_dotenv
 
 # Környezeti változók betöltése .env fájlból
 load_dotenv()
 
+_DEFAULT_LOG_LEVEL = "INFO"
+
+
+def _log_level_from_env() -> str:
+    """LOG_LEVEL beolvasása; ismeretlen szint (pl. VERBOSE) esetén INFO"""
+    level = os.getenv("LOG_LEVEL", _DEFAULT_LOG_LEVEL).strip().upper()
+    if not isinstance(logging.getLevelName(level), int):
+        return _DEFAULT_LOG_LEVEL
+    return level
+
 
 class Config:
     """Konfigurációs osztály a Backendhez"""
@@ -19,10 +30,19 @@ class Config:
     # Szerver konfiguráció
     HOST = os.getenv("HOST", "0.0.0.0")  
     PORT = int(os.getenv("PORT", "8000"))  
+    LOG_LEVEL = _log_level_from_env()
     
     # PDF feldolgozó konfiguráció
     OCR_LANGUAGE = "hun+eng+deu+fra"  # Tesseract nyelvkódok (magyar, angol, német, francia)
     IMAGE_DPI = 300
+    FAST_IMAGE_DPI = 200  # Első OCR menet DPI-je, gyenge oldalaknál IMAGE_DPI-vel ismétlünk
+    # PDF kinyerési eredmények cache könyvtára (üres = kikapcsolva)
+    EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "")
+    # A kinyerési cache legfeljebb ennyi PDF-et tart meg (LRU), 0 = nincs korlát
+    EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "256"))
+    
+    # AI válasz cache (azonos dokumentumok újrafeltöltésekor), 0 = kikapcsolva
+    RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "128"))
     
     NUTRITION_CATEGORIES = [
         "energia",
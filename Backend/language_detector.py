@@ -1,11 +1,55 @@
 """
 Nyelvfelismerő modul többnyelvű PDF feldolgozáshoz.
 """
+import functools
+import re
 from typing import Optional
-from langdetect import detect, DetectorFactory, LangDetectException
 
-# Seed beállítása determinisztikus nyelvfelismeréshez
-DetectorFactory.seed = 42
+# Whitespace sorozatok (szóköz, tab, sortörés) egyetlen szóközre cseréléséhez
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# A langdetect pontossága jóval ennyi karakter alatt telítődik
+_MAX_DETECTION_CHARS = 4096
+
+# Gyors angol felismerés paraméterei (langdetect megkerülése egyértelmű esetben)
+_FAST_PATH_SAMPLE_SIZE = 2000
+_FAST_PATH_MIN_ASCII_RATIO = 0.97
+_FAST_PATH_MIN_STOPWORD_HITS = 2
+_ENGLISH_STOPWORDS = (" the ", " and ", " of ", " ingredients ")
+
+
+# cld3 bemeneti limit (byte) - a neurális háló ennyiből is megbízható
+_CLD3_MAX_BYTES = 1000
+
+
+@functools.lru_cache(maxsize=1)
+def _get_cld3_identifier():
+    """
+    Google cld3 (C++) nyelvfelismerő betöltése, ha a gcld3 csomag telepítve van.
+    
+    Kimenet:
+        NNetLanguageIdentifier példány, vagy None ha a csomag nem elérhető
+    """
+    try:
+        import gcld3
+    except ImportError:
+        return None
+    return gcld3.NNetLanguageIdentifier(min_num_bytes=0, max_num_bytes=_CLD3_MAX_BYTES)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_langdetect():
+    """
+    langdetect késleltetett importálása (csak ha tényleg szükség van rá).
+    
+    Kimenet:
+        Tuple (detect függvény, LangDetectException osztály)
+    """
+    from langdetect import detect, DetectorFactory, LangDetectException
+    
+    # Seed beállítása determinisztikus nyelvfelismeréshez
+    DetectorFactory.seed = 42
+    return detect, LangDetectException
 
 
 class LanguageDetector:
@@ -39,14 +83,51 @@ class LanguageDetector:
         if not text or len(text.strip()) < 10:
             return "en" 
         
+        # Szöveg tisztítása jobb felismerésért
+        # Whitespace normalizálás egy C-szintű menetben, a szöveg elejére korlátozva
+        cleaned_text = _WHITESPACE_RE.sub(" ", text[:_MAX_DETECTION_CHARS]).strip()
+        
+        # Egyértelműen angol szövegnél nincs szükség a lassú n-gram elemzésre
+        if LanguageDetector._is_obviously_english(cleaned_text):
+            return "en"
+        
+        # cld3 (C++, ha telepítve van) - nagyságrendekkel gyorsabb a langdetect-nél
+        identifier = _get_cld3_identifier()
+        if identifier is not None:
+            result = identifier.FindLanguage(text=cleaned_text[:_CLD3_MAX_BYTES])
+            if result.is_reliable:
+                return result.language
+        
+        detect, lang_detect_exception = _get_langdetect()
         try:
-            # Szöveg tisztítása jobb felismerésért
-            cleaned_text = " ".join(text.split())  # Whitespace normalizálás
-            lang_code = detect(cleaned_text)
-            return lang_code
-        except LangDetectException:
+            return detect(cleaned_text)
+        except lang_detect_exception:
             return "en"  # Tartalék: angol
     
+    @staticmethod
+    def _is_obviously_english(text: str) -> bool:
+        """
+        Olcsó előszűrés: szinte csak ASCII karakterek és több gyakori angol szó.
+        
+        Bemenet:
+            text: Whitespace-normalizált szöveg
+            
+        Kimenet:
+            True ha a szöveg biztosan angol (langdetect kihagyható)
+        """
+        sample = text[:_FAST_PATH_SAMPLE_SIZE]
+        if not sample:
+            return False
+        
+        # ASCII arány: az encode("ascii", "ignore") C-ben dobja el a többi karaktert
+        ascii_ratio = len(sample.encode("ascii", "ignore")) / len(sample)
+        if ascii_ratio <= _FAST_PATH_MIN_ASCII_RATIO:
+            return False
+        
+        lowered = f" {sample.lower()} "
+        hits = sum(1 for word in _ENGLISH_STOPWORDS if word in lowered)
+        return hits >= _FAST_PATH_MIN_STOPWORD_HITS
+    
     @classmethod
     def get_language_name(cls, lang_code: str) -> str:
         """
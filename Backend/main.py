@@ -2,20 +2,64 @@
 from fastapi import FastAPI, File, UploadFile, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import traceback
+import asyncio
+import atexit
+import logging
+import queue
+import re
+from contextlib import asynccontextmanager
+from logging.handlers import QueueHandler, QueueListener
+from pathlib import Path
 
 from config import config
-from pdf_processor import PDFProcessor
+from pdf_processor import PDFProcessor, VISION_PAGE_LIMIT
 from text_cleaner import TextCleaner
 from language_detector import LanguageDetector
 from ai_provider import get_ai_provider
 from result_validator import ResultValidator
 
+
+def _configure_logging() -> QueueListener:
+    """
+    Naplózás beállítása: a kérés-kezelő kód csak egy sorba teszi a rekordokat,
+    a tényleges kiírást egy háttérszál (QueueListener) végzi, így a stdout
+    írás nem blokkolja az event loop-ot.
+    """
+    log_queue = queue.SimpleQueue()
+    
+    stream_handler = logging.StreamHandler()
+    stream_handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s: %(message)s"))
+    
+    root_logger = logging.getLogger()
+    root_logger.addHandler(QueueHandler(log_queue))
+    root_logger.setLevel(config.LOG_LEVEL)
+    
+    listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+_log_listener = _configure_logging()
+logger = logging.getLogger(__name__)
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Alkalmazás életciklus: a Gemini szolgáltató induláskor jön létre, így az
+    első kérésnek már nem kell a konfigurációt és a modellt felépítenie.
+    """
+    get_ai_provider()
+    yield
+
+
 # FastAPI alkalmazás inicializálása
 app = FastAPI(
     title="PDF Nutrition Extractor API",
     description="Extract nutrition information and allergens from unstructured PDFs",
-    version="2.0.0"
+    version="2.0.0",
+    lifespan=lifespan
 )
 
 # CORS konfiguráció
@@ -30,9 +74,56 @@ app.add_middleware(
 # Feldolgozók inicializálása
 pdf_processor = PDFProcessor(
     ocr_languages=config.OCR_LANGUAGE,
-    image_dpi=config.IMAGE_DPI
+    image_dpi=config.IMAGE_DPI,
+    fast_image_dpi=config.FAST_IMAGE_DPI,
+    cache_dir=Path(config.EXTRACTION_CACHE_DIR) if config.EXTRACTION_CACHE_DIR else None,
+    cache_max_entries=config.EXTRACTION_CACHE_MAX_ENTRIES
 )
 
+# Feltöltött fájl olvasási blokkmérete
+_UPLOAD_CHUNK_SIZE = 1024 * 1024
+
+# Gyakori OCR hibák a tápértékekben: "LL" 1.1 helyett, "II" 11 helyett, "Sig" 5g helyett
+_OCR_ARTIFACT_RE = re.compile(r'LL|Sig|II')
+
+
+def _is_poor_quality_result(result: dict, ocr_used: bool) -> bool:
+    """
+    Észleli ha a kinyerési eredmény rossz minőségű és Vision API fallback kell.
+    
+    Ellenőrzések:
+    1. Üres tápérték adatok
+    2. Minden érték null
+    3. Hiányzó kritikus nátrium/só adat (gyakori OCR hiba)
+    4. Ha OCR-t használtunk: gyakori OCR artifaktok ellenőrzése
+    """
+    nutrition = result.get("nutrition")
+    
+    # Üres eredmény
+    if not nutrition:
+        return True
+    
+    # Hiányzó nátrium/só (kritikus tápértékjelzésnél). Ez a "minden érték null"
+    # esetet is lefedi: ha van nátrium érték, nem lehet minden érték null,
+    # így a teljes bejárásra és ideiglenes üres dict-ekre nincs szükség.
+    sodium = nutrition.get("nátrium")
+    if not sodium or sodium.get("per_100g") is None:
+        return True
+    
+    if ocr_used:
+        # Gyanús OCR artifaktok keresése az összes értékben egyetlen regex menetben
+        values = "|".join(str(v.get("per_100g", "")) for v in nutrition.values())
+        if _OCR_ARTIFACT_RE.search(values):
+            return True
+    
+    return False
+
+
+def _ignore_task_result(task: asyncio.Task) -> None:
+    """Eldobott (spekulatív) task kivételének elnyelése, hogy ne kerüljön naplóba."""
+    if not task.cancelled():
+        task.exception()
+
 
 @app.get("/")
 async def root():
@@ -63,13 +154,17 @@ async def analyze_pdf(
         raise HTTPException(status_code=400, detail="Csak PDF fájlok támogatottak")
     
     try:
-        # PDF fájl beolvasása
-        pdf_bytes = await file.read()
+        # PDF fájl beolvasása darabokban egy növekvő bufferbe
+        # (nincs egyetlen teljes méretű read() allokáció és másolás)
+        pdf_bytes = bytearray()
+        while chunk := await file.read(_UPLOAD_CHUNK_SIZE):
+            pdf_bytes.extend(chunk)
         
         # 1. lépés: PDF tartalom kinyerése layout megőrzéssel
         document = await pdf_processor.extract_document(pdf_bytes)
         
-        print(document.text if document.text else "Üres!")
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Kinyert szöveg: %s", document.text if document.text else "Üres!")
         
         if not document.text or len(document.text.strip()) < 20:
             raise HTTPException(
@@ -86,7 +181,7 @@ async def analyze_pdf(
         detected_language = LanguageDetector.detect_language(cleaned_text)
         document.language_hint = detected_language
         
-        print(f"Észlelt nyelv: {LanguageDetector.get_language_name(detected_language)}")
+        logger.info("Észlelt nyelv: %s", LanguageDetector.get_language_name(detected_language))
         
         # 4. lépés: Layout kontextus előkészítése AI-nek
         layout_lines = document.to_prompt_lines(max_lines=100)
@@ -102,67 +197,50 @@ async def analyze_pdf(
         # 5. lépés: AI elemzés
         ai_provider = get_ai_provider()
         
-        # Először szöveg alapú kinyerést próbálunk
-        extraction_result = await ai_provider.analyze_pdf(
-            text=cleaned_text,
-            layout_lines=layout_lines,
-            language=detected_language,
-            metadata=metadata
-        )
+        # Vision API spekulatív indítása: OCR-es dokumentumnál nagy eséllyel
+        # szükség lesz rá, így a két hívás ideje nem adódik össze. Oldalképek
+        # csak OCR esetén készülnek, így ez az egyetlen Vision indítási pont.
+        # Költség: minden OCR-es feltöltés Vision kérést küld, akkor is, ha a
+        # szöveges eredmény jó és a hívást megszakítjuk.
+        vision_task = None
+        if metadata["ocr_used"] and document.image_paths:
+            vision_task = asyncio.create_task(ai_provider.analyze_pdf_with_vision(
+                images=document.image_paths[:VISION_PAGE_LIMIT],
+                language=detected_language,
+                metadata=metadata
+            ))
+            vision_task.add_done_callback(_ignore_task_result)
+        
+        try:
+            # Először szöveg alapú kinyerést próbálunk
+            extraction_result = await ai_provider.analyze_pdf(
+                text=cleaned_text,
+                layout_lines=layout_lines,
+                language=detected_language,
+                metadata=metadata
+            )
+        except Exception:
+            if vision_task is not None:
+                vision_task.cancel()
+            raise
         
         # Vision API Fallback (hibrid megközelítés)
         # Ellenőrizzük hogy az eredmény üres, rossz minőségű vagy hiányzik belőle kritikus adat
-        def is_poor_quality_result(result: dict, ocr_used: bool) -> bool:
-            """
-            Észleli ha a kinyerési eredmény rossz minőségű és Vision API fallback kell.
-            
-            Ellenőrzések:
-            1. Üres tápérték adatok
-            2. Minden érték null
-            3. Hiányzó kritikus nátrium/só adat (gyakori OCR hiba)
-            4. Ha OCR-t használtunk: gyakori OCR artifaktok ellenőrzése
-            """
-            nutrition = result.get("nutrition", {})
-            
-            # Üres eredmény
-            if not nutrition:
-                return True
-            
-            # Minden érték null
-            if all(v.get("per_100g") is None for v in nutrition.values()):
-                return True
-            
-            # Hiányzó nátrium/só (kritikus tápértékjelzésnél)
-            sodium = nutrition.get("nátrium", {}).get("per_100g")
-            if sodium is None:
-                return True
-            
-            
-            if ocr_used:
-                # Ellenőrizzük hogy az értékek tartalmaznak-e gyanús OCR artifaktokat
-                for key, value_dict in nutrition.items():
-                    value = str(value_dict.get("per_100g", ""))
-                    # Gyakori OCR hibák: "LL" 1.1 helyett, "O" 0 helyett
-                    if any(suspect in value for suspect in ["LL", "Sig", "II"]):
-                        return True
-            
-            return False
-        
-        is_poor_result = is_poor_quality_result(extraction_result, metadata.get("ocr_used", False))
-        
-        if is_poor_result and document.images and len(document.images) > 0:
+        is_poor_result = _is_poor_quality_result(extraction_result, metadata.get("ocr_used", False))
+        
+        if is_poor_result and vision_task is not None:
             try:
-                extraction_result = await ai_provider.analyze_pdf_with_vision(
-                    images=document.images[:3],  # Max 3 oldal API költség csökkentésére
-                    language=detected_language,
-                    metadata=metadata
-                )
+                # shield: a kérés megszakítása ne hagyja félbe a Vision hívást
+                extraction_result = await asyncio.shield(vision_task)
                 metadata["vision_api_used"] = True
                 metadata["vision_reason"] = "poor_quality_ocr"
             except Exception as vision_error:
                 metadata["vision_api_used"] = False
                 # Megtartjuk az eredeti (rossz minőségű) eredményt
         else:
+            # A szöveges eredmény megfelelő - a spekulatív Vision hívás felesleges
+            if vision_task is not None:
+                vision_task.cancel()
             metadata["vision_api_used"] = False
         
         # Eredmények validálása és normalizálása
@@ -184,8 +262,7 @@ async def analyze_pdf(
         raise
     
     except Exception as e:
-        print(f"Hiba a PDF elemzése során: {e}")
-        traceback.print_exc()
+        logger.exception("Hiba a PDF elemzése során: %s", e)
         
         raise HTTPException(
             status_code=500,
@@ -217,6 +294,7 @@ async def get_config():
         "ai_provider": config.AI_PROVIDER,
         "ocr_languages": config.OCR_LANGUAGE,
         "image_dpi": config.IMAGE_DPI,
+        "fast_image_dpi": config.FAST_IMAGE_DPI,
         "nutrition_categories": config.NUTRITION_CATEGORIES
     }
 
@@ -2,23 +2,290 @@
 PDF feldolgozó modul, kezeli a szöveg-alapú és szkennelt PDF-eket bounding box információval.
 """
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Any, Tuple
+from functools import cached_property
+from itertools import groupby
+from operator import itemgetter
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, TypeVar
+import asyncio
+import hashlib
 import io
+import logging
 import os
+import re
+import shutil
+import tempfile
+import weakref
 import pdfplumber
 import fitz  # PyMuPDF
-from pdf2image import convert_from_bytes
-from PIL import Image
+import orjson
+from PIL import Image, ImageOps
 import pytesseract
 
+from process_pool import PROCESS_POOL_WORKERS, run_in_process_pool
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
 # Tesseract útvonal konfigurálása Windows-on
 if os.name == 'nt':  # Windows
     tesseract_path = r"C:\Program Files\Tesseract-OCR\tesseract.exe"
     if os.path.exists(tesseract_path):
         pytesseract.pytesseract.tesseract_cmd = tesseract_path
 
+# Nem alfanumerikus, nem whitespace karakter (az aláhúzás is ide tartozik,
+# a \w-vel ellentétben az isalnum() nem fogadja el)
+_SPECIAL_CHAR_RE = re.compile(r'[^\w\s]|_')
 
-@dataclass
+# Ennyi oldaltól dolgozzuk fel a pdfplumber oldalakat párhuzamosan
+_PARALLEL_MIN_PAGES = 4
+
+# PyMuPDF "words" tuple-ök sorazonosítója: (blokk, sor)
+_WORD_LINE_KEY = itemgetter(5, 6)
+
+# Kinyerési cache formátum verzió - növelni kell ha a tárolt szerkezet változik
+_EXTRACTION_CACHE_VERSION = 2
+
+# OCR pipeline lépcsők közötti sorok mérete (ennyi oldal várakozhat egy lépcső előtt)
+_PIPELINE_QUEUE_SIZE = 4
+
+# Ennyi oldalról készül (és kerül a Vision API-hoz) színes kép - API költség csökkentésére
+VISION_PAGE_LIMIT = 3
+
+# Egy Tesseract hívásban feldolgozott oldalak maximális száma
+_OCR_BATCH_MAX_PAGES = 8
+
+def _ocr_page_batch(
+    pages: List[Tuple[int, str, Tuple[int, int], bytes]],
+    languages: str
+) -> List[Tuple[int, Dict[str, list]]]:
+    """
+    Oldalblokk OCR-je egyetlen Tesseract hívással (folyamat poolban fut).
+    
+    A képek nyers pixelekként érkeznek (oldalszám + mode + méret + bájtok),
+    így a folyamatok közötti átadás nem igényel PIL pickle-t. Több oldalnál
+    a képek egy többoldalas TIFF-be kerülnek, így a Tesseract indítása és a
+    nyelvi modellek betöltése blokkonként csak egyszer történik meg; a
+    kimenetet a "page_num" oszlop alapján bontjuk oldalakra.
+    
+    Visszatérés:
+        (oldalszám, pytesseract image_to_data dict) párok a bemenet sorrendjében
+    """
+    images = [Image.frombytes(mode, size, pixels) for _, mode, size, pixels in pages]
+    
+    if len(images) == 1:
+        ocr_data = pytesseract.image_to_data(
+            images[0],
+            lang=languages,
+            output_type=pytesseract.Output.DICT
+        )
+        return [(pages[0][0], ocr_data)]
+    
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        tiff_path = os.path.join(tmp_dir, "pages.tif")
+        images[0].save(tiff_path, format="TIFF", save_all=True, append_images=images[1:])
+        ocr_data = pytesseract.image_to_data(
+            tiff_path,
+            lang=languages,
+            output_type=pytesseract.Output.DICT
+        )
+    
+    # Sorok szétosztása oldalakra (a TSV page_num 1-től számolja a TIFF lapjait)
+    page_data = [{key: [] for key in ocr_data} for _ in pages]
+    for row, frame in enumerate(ocr_data["page_num"]):
+        target = page_data[frame - 1]
+        for key, values in ocr_data.items():
+            target[key].append(values[row])
+    
+    return [(page[0], data) for page, data in zip(pages, page_data)]
+
+
+def _otsu_threshold(histogram: List[int]) -> int:
+    """
+    Otsu küszöbérték számítása szürkeárnyalatos hisztogramból.
+    
+    Azt a küszöböt választja, amelynél a két osztály (háttér, előtér)
+    közötti variancia maximális.
+    """
+    total = sum(histogram)
+    sum_all = sum(value * count for value, count in enumerate(histogram))
+    
+    sum_background = 0
+    weight_background = 0
+    best_threshold = 0
+    best_variance = 0.0
+    
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        
+        if variance > best_variance:
+            best_variance = variance
+            best_threshold = threshold
+    
+    return best_threshold
+
+
+def _extract_plumber_pages(pdf_bytes: bytes, page_numbers: range) -> List["StructuredLine"]:
+    """
+    Oldaltartomány szövegének kinyerése pdfplumber-rel (folyamat poolban is fut).
+    
+    Minden hívás saját példányban nyitja meg a PDF-et.
+    
+    Paraméterek:
+        pdf_bytes: PDF fájl tartalom
+        page_numbers: Feldolgozandó oldalak (0-tól)
+        
+    Visszatérés:
+        A tartomány sorai oldalsorrendben
+    """
+    lines = []
+    with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+        # Az oldaltartomány a MuPDF oldalszámából jön; sérült vagy javított
+        # PDF-nél a pdfminer kevesebb oldalt láthat - a többit kihagyjuk
+        page_total = len(pdf.pages)
+        for page_num in page_numbers:
+            if page_num >= page_total:
+                break
+            
+            # Szavak kinyerése pozíciókkal
+            words = pdf.pages[page_num].extract_words(
+                x_tolerance=3,
+                y_tolerance=3,
+                keep_blank_chars=False
+            )
+            
+            if not words:
+                continue
+            
+            # Szavak csoportosítása sorokba y-pozíció alapján
+            lines.extend(_group_words_into_lines(words, page_num))
+    return lines
+
+
+def _char_count(lines: List["StructuredLine"]) -> int:
+    """Sorok összes karakterszáma."""
+    return sum(len(line.text) for line in lines)
+
+
+def _group_words_into_lines(words: List[Dict[str, Any]], page_num: int) -> List["StructuredLine"]:
+    """
+    pdfplumber szavak csoportosítása sorokba y-pozíció alapján.
+    
+    Új sor indul, ha a szó teteje több mint 5 ponttal eltér a sor első
+    szavától. Először csak a sorhatárokat keressük meg (egy menet a
+    "top" értékeken), utána soronként egyszer építjük a szöveget és a
+    bounding boxot (első szó x0/top/bottom, utolsó szó x1) - nincs
+    szavankénti lista- és bbox-módosítás.
+    
+    Paraméterek:
+        words: page.extract_words() kimenete (nem üres)
+        page_num: Oldalszám (0-tól)
+        
+    Visszatérés:
+        Az oldal sorai
+    """
+    tops = [word["top"] for word in words]
+    
+    # Sorhatárok: minden sor első szavának indexe
+    starts = [0]
+    anchor_top = tops[0]
+    for i in range(1, len(tops)):
+        if abs(tops[i] - anchor_top) > 5:
+            starts.append(i)
+            anchor_top = tops[i]
+    ends = starts[1:] + [len(words)]
+    
+    lines = []
+    for start, end in zip(starts, ends):
+        first = words[start]
+        lines.append(StructuredLine(
+            text=" ".join([word["text"] for word in words[start:end]]),
+            bbox=BoundingBox(
+                x0=first["x0"],
+                y0=first["top"],
+                x1=words[end - 1]["x1"],
+                y1=first["bottom"],
+                page=page_num
+            ),
+            source="pdfplumber"
+        ))
+    return lines
+
+
+def _ocr_data_to_lines(ocr_data: Dict[str, list], page_num: int) -> List["StructuredLine"]:
+    """
+    Tesseract szavak csoportosítása sorokba.
+    
+    Paraméterek:
+        ocr_data: pytesseract image_to_data dict kimenete
+        page_num: Oldalszám (0-tól)
+        
+    Visszatérés:
+        Az oldal sorai
+    """
+    lines = []
+    current_line = []
+    current_line_num = None
+    current_bbox = None
+    
+    for i in range(len(ocr_data["text"])):
+        text = ocr_data["text"][i].strip()
+        conf = float(ocr_data["conf"][i])
+        line_num = ocr_data["line_num"][i]
+        
+        if not text or conf < 0:
+            continue
+        
+        # Új sor indítása
+        if current_line_num is None or line_num != current_line_num:
+            # Előző sor mentése
+            if current_line:
+                lines.append(StructuredLine(
+                    text=" ".join(current_line),
+                    bbox=current_bbox,
+                    source="ocr"
+                ))
+            
+            # Új sor indítása
+            current_line = [text]
+            current_line_num = line_num
+            current_bbox = BoundingBox(
+                x0=ocr_data["left"][i],
+                y0=ocr_data["top"][i],
+                x1=ocr_data["left"][i] + ocr_data["width"][i],
+                y1=ocr_data["top"][i] + ocr_data["height"][i],
+                page=page_num
+            )
+        else:
+            # Jelenlegi sor folytatása
+            current_line.append(text)
+            # Bbox kiterjesztése
+            if current_bbox:
+                current_bbox.x1 = ocr_data["left"][i] + ocr_data["width"][i]
+    
+    # Utolsó sor mentése
+    if current_line:
+        lines.append(StructuredLine(
+            text=" ".join(current_line),
+            bbox=current_bbox,
+            source="ocr"
+        ))
+    
+    return lines
+
+
+@dataclass(slots=True)
 class BoundingBox:
     """Szöveg pozíciója az oldalon."""
     x0: float
@@ -36,7 +303,7 @@ class BoundingBox:
         return self.y1 - self.y0
 
 
-@dataclass
+@dataclass(slots=True)
 class StructuredLine:
     """Egyetlen szövegsor metaadatokkal."""
     text: str
@@ -56,15 +323,23 @@ class StructuredDocument:
     has_text: bool  # True ha a PDF kinyerhető szöveget tartalmaz
     ocr_used: bool  # True ha OCR-t használtunk
     language_hint: Optional[str]  # Észlelt nyelv kód
-    images: Optional[List[Image.Image]] = None  # PDF oldalak képként (Vision API fallback-hez)
+    image_paths: Optional[List[Path]] = None  # PDF oldalak képfájljai (Vision API fallback-hez)
     
     def get_text_with_positions(self) -> List[Dict[str, Any]]:
         """
         Szövegsorok lekérése pozíció információval.
         
+        A lista első híváskor épül fel, utána ugyanazt a példányt adjuk
+        vissza (a hívó ne módosítsa).
+        
         Visszatérés:
             Szótárak listája szöveg és pozíció adatokkal
         """
+        return self._text_with_positions
+    
+    @cached_property
+    def _text_with_positions(self) -> List[Dict[str, Any]]:
+        """A get_text_with_positions egyszer felépített eredménye."""
         result = []
         for line in self.lines:
             item = {
@@ -92,31 +367,56 @@ class StructuredDocument:
         Visszatérés:
             Formázott string a prompt-hoz
         """
-        lines_to_include = self.lines[:max_lines]
-        formatted = []
-        
-        for i, line in enumerate(lines_to_include, 1):
-            formatted.append(f"{i}. {line.text}")
+        formatted = "\n".join(
+            f"{i}. {line.text}" for i, line in enumerate(self.lines[:max_lines], 1)
+        )
         
-        if len(self.lines) > max_lines:
-            formatted.append(f"... ({len(self.lines) - max_lines} more lines)")
+        remaining = len(self.lines) - max_lines
+        if remaining > 0:
+            more = f"... ({remaining} more lines)"
+            # Üres sorlista (pl. max_lines=0) esetén nincs vezető sortörés
+            formatted = f"{formatted}\n{more}" if formatted else more
         
-        return "\n".join(formatted)
+        return formatted
 
 
 class PDFProcessor:
     """Fejlett PDF feldolgozó többlépcsős kinyerési stratégiával."""
     
-    def __init__(self, ocr_languages: str = "hun+eng+deu+fra", image_dpi: int = 300):
+    def __init__(
+        self,
+        ocr_languages: str = "hun+eng+deu+fra",
+        image_dpi: int = 300,
+        fast_image_dpi: int = 200,
+        cache_dir: Optional[Path] = None,
+        cache_max_entries: int = 256
+    ):
         """
         PDF feldolgozó inicializálása.
         
         Paraméterek:
             ocr_languages: Tesseract nyelv kódok (pl. "hun+eng+deu+fra")
-            image_dpi: DPI a PDF-képpé konverzióhoz
+            image_dpi: DPI a PDF-képpé konverzióhoz (gyenge minőségű oldalak újra-OCR-je)
+            fast_image_dpi: DPI az első OCR menethez
+            cache_dir: Kinyerési eredmények cache könyvtára (None = nincs cache)
+            cache_max_entries: Cache bejegyzések maximális száma, a legrégebben
+                használtak törlődnek (0 = nincs korlát)
         """
         self.ocr_languages = ocr_languages
         self.image_dpi = image_dpi
+        self.fast_image_dpi = min(fast_image_dpi, image_dpi)
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        if self.cache_dir is not None:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        
+        # A kinyerés eredménye a beállításoktól is függ: ezek a cache kulcs részei
+        self._cache_key_prefix = orjson.dumps([
+            _EXTRACTION_CACHE_VERSION,
+            self.ocr_languages,
+            self.image_dpi,
+            self.fast_image_dpi
+        ])
     
     async def extract_document(self, pdf_bytes: bytes) -> StructuredDocument:
         """
@@ -128,238 +428,541 @@ class PDFProcessor:
         Visszatérés:
             StructuredDocument az összes kinyert tartalommal és metaadatokkal
         """
-        # pdfplumber próbálása először (legjobb szöveges PDF-ekhez layout-tal)
-        plumber_lines = await self._extract_with_pdfplumber(pdf_bytes)
-        
-        # PyMuPDF mint fallback
-        if not plumber_lines or len(plumber_lines) < 5:
-            pymupdf_lines = await self._extract_with_pymupdf(pdf_bytes)
-            if len(pymupdf_lines) > len(plumber_lines):
-                plumber_lines = pymupdf_lines
-        
-        # Eldöntjük hogy kell-e OCR
-        has_text = len(plumber_lines) > 0
-        ocr_needed = not has_text or self._is_low_quality_text(plumber_lines)
+        # Azonos tartalmú PDF-et (azonos beállításokkal) nem dolgozunk fel újra
+        cache_key = None
+        if self.cache_dir is not None:
+            cache_key = self._cache_key(pdf_bytes)
+            cached_document = await asyncio.to_thread(self._load_from_cache, cache_key)
+            if cached_document is not None:
+                logger.info("Kinyerési eredmény a cache-ből: %s", cache_key)
+                return cached_document
         
-        all_lines = plumber_lines
-        pdf_images = None
-        
-        # OCR alkalmazása ha kell
-        if ocr_needed:
-            ocr_lines, pdf_images = await self._extract_with_ocr(pdf_bytes)
-            # OCR eredmények összefésülése a meglévő szöveggel
-            if len(ocr_lines) > len(all_lines):
-                all_lines = ocr_lines
+        # A PyMuPDF dokumentumot egyszer nyitjuk meg, és minden lépés ezt használja
+        fitz_doc = self._open_fitz_document(pdf_bytes)
+        image_dir = None
+        # Hibás lépés (pl. átmeneti Tesseract vagy pool hiba) eredménye nem kerül cache-be
+        extraction_ok = fitz_doc is not None
+        try:
+            # Oldalak számolása (egyszer, a megnyitott dokumentumból)
+            page_count = self._count_pages(fitz_doc)
+            
+            # pdfplumber próbálása először (legjobb szöveges PDF-ekhez layout-tal)
+            plumber_lines, plumber_ok = await self._extract_with_pdfplumber(
+                pdf_bytes, page_count if fitz_doc is not None else None
+            )
+            extraction_ok = extraction_ok and plumber_ok
+            
+            # PyMuPDF mint fallback
+            if fitz_doc is not None and (not plumber_lines or len(plumber_lines) < 5):
+                pymupdf_lines, pymupdf_ok = await self._extract_with_pymupdf(fitz_doc)
+                extraction_ok = extraction_ok and pymupdf_ok
+                if len(pymupdf_lines) > len(plumber_lines):
+                    plumber_lines = pymupdf_lines
+            
+            # Eldöntjük hogy kell-e OCR
+            has_text = len(plumber_lines) > 0
+            ocr_needed = not has_text or self._is_low_quality_text(plumber_lines)
+            
+            all_lines = plumber_lines
+            image_paths = None
+            
+            # OCR alkalmazása ha kell
+            if ocr_needed and fitz_doc is not None:
+                # A renderelt oldalak lemezre kerülnek, nem maradnak a memóriában
+                image_dir = Path(tempfile.mkdtemp(prefix="pdf_pages_"))
+                ocr_lines, image_paths, ocr_ok = await self._extract_with_ocr(fitz_doc, image_dir)
+                extraction_ok = extraction_ok and ocr_ok
+                # OCR eredmények összefésülése a meglévő szöveggel
+                if len(ocr_lines) > len(all_lines):
+                    all_lines = ocr_lines
+        except BaseException:
+            if image_dir is not None:
+                shutil.rmtree(image_dir, ignore_errors=True)
+            raise
+        finally:
+            if fitz_doc is not None:
+                fitz_doc.close()
         
         # Teljes szöveg összeállítása
         full_text = "\n".join(line.text for line in all_lines)
         
-        # Oldalak számolása
-        page_count = self._count_pages(pdf_bytes)
-        
-        return StructuredDocument(
+        document = StructuredDocument(
             text=full_text,
             lines=all_lines,
             page_count=page_count,
             has_text=has_text,
             ocr_used=ocr_needed,
             language_hint=None,  # LanguageDetector fogja beállítani
-            images=pdf_images  # Képek tárolása Vision API fallback-hez
+            image_paths=image_paths  # Képfájlok Vision API fallback-hez
         )
+        
+        # Az oldalképek könyvtára a dokumentummal együtt szűnik meg
+        if image_dir is not None:
+            weakref.finalize(document, shutil.rmtree, image_dir, ignore_errors=True)
+        
+        if cache_key is not None and extraction_ok and full_text.strip():
+            try:
+                await asyncio.to_thread(self._store_in_cache, cache_key, document)
+            except Exception as e:
+                logger.warning("Kinyerési cache írás sikertelen: %s", e)
+        
+        return document
     
-    async def _extract_with_pdfplumber(self, pdf_bytes: bytes) -> List[StructuredLine]:
-        """Szöveg kinyerése pdfplumber-rel, layout és pozíciók megőrzésével."""
-        lines = []
+    def _cache_key(self, pdf_bytes: bytes) -> str:
+        """Cache kulcs: SHA-256 a beállításokra (és cache verzióra) és a PDF tartalomra."""
+        hasher = hashlib.sha256(self._cache_key_prefix)
+        hasher.update(pdf_bytes)
+        return hasher.hexdigest()
+    
+    def _load_from_cache(self, cache_key: str) -> Optional[StructuredDocument]:
+        """
+        Korábbi kinyerési eredmény betöltése a cache könyvtárból.
         
+        Paraméterek:
+            cache_key: A bejegyzés kulcsa (lásd _cache_key)
+            
+        Visszatérés:
+            StructuredDocument, vagy None ha nincs (érvényes) bejegyzés
+        """
+        cache_path = self.cache_dir / f"{cache_key}.json"
         try:
-            with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
-                for page_num, page in enumerate(pdf.pages):
-                    # Szavak kinyerése pozíciókkal
-                    words = page.extract_words(
-                        x_tolerance=3,
-                        y_tolerance=3,
-                        keep_blank_chars=False
-                    )
-                    
-                    if not words:
-                        continue
-                    
-                    # Szavak csoportosítása sorokba y-pozíció alapján
-                    current_line = []
-                    current_y = None
-                    current_bbox = None
-                    
-                    for word in words:
-                        y_pos = word["top"]
-                        
-                        # Új sor indítása ha y-pozíció jelentősen változik
-                        if current_y is None or abs(y_pos - current_y) > 5:
-                            # Előző sor mentése
-                            if current_line:
-                                text = " ".join(current_line)
-                                lines.append(StructuredLine(
-                                    text=text,
-                                    bbox=current_bbox,
-                                    source="pdfplumber"
-                                ))
-                            
-                            # Új sor indítása
-                            current_line = [word["text"]]
-                            current_y = y_pos
-                            current_bbox = BoundingBox(
-                                x0=word["x0"],
-                                y0=word["top"],
-                                x1=word["x1"],
-                                y1=word["bottom"],
-                                page=page_num
-                            )
-                        else:
-                            # Jelenlegi sor folytatása
-                            current_line.append(word["text"])
-                            # Bounding box kiterjesztése
-                            if current_bbox:
-                                current_bbox.x1 = word["x1"]
-                    
-                    # Utolsó sor mentése
-                    if current_line:
-                        text = " ".join(current_line)
-                        lines.append(StructuredLine(
-                            text=text,
-                            bbox=current_bbox,
-                            source="pdfplumber"
-                        ))
+            data = orjson.loads(cache_path.read_bytes())
+        except FileNotFoundError:
+            return None
+        except (OSError, orjson.JSONDecodeError) as e:
+            logger.warning("Sérült kinyerési cache bejegyzés (%s): %s", cache_key, e)
+            return None
         
-        except Exception as e:
-            print(f"pdfplumber extraction failed: {e}")
+        if data.get("version") != _EXTRACTION_CACHE_VERSION:
+            return None
+        
+        # Használat jelölése az LRU törléshez (lásd _prune_cache)
+        try:
+            os.utime(cache_path)
+        except OSError:
+            pass
+        
+        lines = [
+            StructuredLine(
+                text=line["text"],
+                bbox=BoundingBox(**line["bbox"]) if line["bbox"] else None,
+                source=line["source"]
+            )
+            for line in data["lines"]
+        ]
+        
+        # Oldalképek (csak OCR-es dokumentumnál) - saját ideiglenes másolatba,
+        # hogy egy közben futó _prune_cache ne törölje őket a Vision hívás alól
+        image_dir = None
+        image_paths = None
+        if data["image_count"]:
+            image_dir = Path(tempfile.mkdtemp(prefix="pdf_pages_"))
+            image_paths = [image_dir / f"page_{i}.png" for i in range(data["image_count"])]
+            try:
+                for i, image_path in enumerate(image_paths):
+                    shutil.copyfile(self.cache_dir / f"{cache_key}_page_{i}.png", image_path)
+            except OSError as e:
+                # A bejegyzést közben törölték - cache miss-ként kezeljük
+                shutil.rmtree(image_dir, ignore_errors=True)
+                logger.warning("Hiányos kinyerési cache bejegyzés (%s): %s", cache_key, e)
+                return None
+        
+        document = StructuredDocument(
+            text=data["text"],
+            lines=lines,
+            page_count=data["page_count"],
+            has_text=data["has_text"],
+            ocr_used=data["ocr_used"],
+            language_hint=None,
+            image_paths=image_paths
+        )
+        
+        if image_dir is not None:
+            weakref.finalize(document, shutil.rmtree, image_dir, ignore_errors=True)
+        
+        return document
+    
+    def _store_in_cache(self, cache_key: str, document: StructuredDocument) -> None:
+        """
+        Kinyerési eredmény mentése a cache könyvtárba.
+        
+        OCR-es dokumentumnál a Vision oldalképek PNG fájljai a JSON mellé
+        másolódnak. A JSON kerül utoljára a helyére, így félig megírt
+        bejegyzést a betöltés nem lát. Mentés után a méretkorlát feletti,
+        legrégebben használt bejegyzések törlődnek.
+        """
+        image_paths = document.image_paths or []
+        for i, image_path in enumerate(image_paths):
+            shutil.copyfile(image_path, self.cache_dir / f"{cache_key}_page_{i}.png")
+        
+        data = {
+            "version": _EXTRACTION_CACHE_VERSION,
+            "text": document.text,
+            # Az orjson a dataclass-okat közvetlenül szerializálja (asdict mély másolása nélkül)
+            "lines": document.lines,
+            "page_count": document.page_count,
+            "has_text": document.has_text,
+            "ocr_used": document.ocr_used,
+            "image_count": len(image_paths)
+        }
+        cache_path = self.cache_dir / f"{cache_key}.json"
+        tmp_path = cache_path.with_suffix(".json.tmp")
+        tmp_path.write_bytes(orjson.dumps(data))
+        os.replace(tmp_path, cache_path)
         
-        return lines
+        self._prune_cache()
     
-    async def _extract_with_pymupdf(self, pdf_bytes: bytes) -> List[StructuredLine]:
-        """Szöveg kinyerése PyMuPDF-fel fallback-ként."""
+    def _prune_cache(self) -> None:
+        """
+        A legrégebben használt bejegyzések törlése, ha a cache túllépi a korlátot.
+        
+        A használat ideje a JSON fájl módosítási ideje (betöltéskor frissül).
+        """
+        if self.cache_max_entries <= 0:
+            return
+        
+        entries = []
+        for cache_path in self.cache_dir.glob("*.json"):
+            try:
+                entries.append((cache_path.stat().st_mtime, cache_path))
+            except FileNotFoundError:
+                continue
+        
+        if len(entries) <= self.cache_max_entries:
+            return
+        
+        entries.sort()
+        for _, cache_path in entries[:len(entries) - self.cache_max_entries]:
+            # Előbb a JSON, hogy a betöltés ne lásson képek nélküli bejegyzést
+            cache_path.unlink(missing_ok=True)
+            for image_path in self.cache_dir.glob(f"{cache_path.stem}_page_*.png"):
+                image_path.unlink(missing_ok=True)
+    
+    async def _extract_with_pdfplumber(
+        self,
+        pdf_bytes: bytes,
+        page_count: Optional[int] = None
+    ) -> Tuple[List[StructuredLine], bool]:
+        """
+        Szöveg kinyerése pdfplumber-rel, layout és pozíciók megőrzésével.
+        
+        Több oldalas PDF-nél az oldaltartományok párhuzamosan, a folyamat
+        poolban dolgozódnak fel (a pdfminer tiszta Python, szálakkal nem
+        gyorsulna, és a megnyitott dokumentum sem használható több szálból).
+        
+        Paraméterek:
+            pdf_bytes: PDF fájl tartalom
+            page_count: Ismert oldalszám (None esetén pdfplumber-rel számoljuk)
+        
+        Visszatérés:
+            Tuple (sorok, sikeres volt-e a kinyerés)
+        """
         lines = []
         
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+            if page_count is None:
+                with pdfplumber.open(io.BytesIO(pdf_bytes)) as pdf:
+                    page_count = len(pdf.pages)
             
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                blocks = page.get_text("dict")["blocks"]
-                
-                for block in blocks:
-                    if "lines" not in block:
-                        continue
-                    
-                    for line in block["lines"]:
-                        spans = line["spans"]
-                        if not spans:
-                            continue
-                        
-                        # Span-ek összefűzése sor szöveggé
-                        text = " ".join(span["text"] for span in spans)
-                        
-                        # Bounding box az első és utolsó span-ből
-                        first_span = spans[0]
-                        last_span = spans[-1]
-                        
-                        bbox = BoundingBox(
-                            x0=first_span["bbox"][0],
-                            y0=first_span["bbox"][1],
-                            x1=last_span["bbox"][2],
-                            y1=last_span["bbox"][3],
-                            page=page_num
-                        )
-                        
-                        lines.append(StructuredLine(
-                            text=text,
-                            bbox=bbox,
-                            source="pymupdf"
-                        ))
+            if page_count < _PARALLEL_MIN_PAGES:
+                lines = await asyncio.to_thread(_extract_plumber_pages, pdf_bytes, range(page_count))
+                return lines, True
+            
+            # Összefüggő oldaltartományok, workerenként egy
+            chunk_size = -(-page_count // PROCESS_POOL_WORKERS)
+            page_results = await asyncio.gather(*(
+                run_in_process_pool(
+                    _extract_plumber_pages,
+                    pdf_bytes,
+                    range(first, min(first + chunk_size, page_count))
+                )
+                for first in range(0, page_count, chunk_size)
+            ))
             
-            doc.close()
+            # A gather megőrzi a tartományok (oldalak) sorrendjét
+            for page_lines in page_results:
+                lines.extend(page_lines)
         
         except Exception as e:
-            print(f"PyMuPDF extraction failed: {e}")
+            logger.warning("pdfplumber extraction failed: %s", e)
+            return lines, False
         
-        return lines
+        return lines, True
     
-    async def _extract_with_ocr(self, pdf_bytes: bytes) -> Tuple[List[StructuredLine], List[Image.Image]]:
+    async def _extract_with_pymupdf(self, doc: fitz.Document) -> Tuple[List[StructuredLine], bool]:
         """
-        Szöveg kinyerése OCR-rel (Tesseract).
+        Szöveg kinyerése PyMuPDF-fel fallback-ként.
+        
+        A "words" kimenet lapos tuple lista (x0, y0, x1, y1, szó, blokk, sor, szó_sorszám),
+        így nem épül fel a "dict" mód teljes span fája.
         
         Visszatérés:
-            Tuple (sorok, képek) - képek tárolása Vision API fallback-hez
+            Tuple (sorok, sikeres volt-e a kinyerés)
         """
         lines = []
-        images = []
         
         try:
-            # PDF konvertálása képekké
-            images = convert_from_bytes(pdf_bytes, dpi=self.image_dpi)
-            print(f"PDF konvertálva {len(images)} képpé")
-            
-            for page_num, image in enumerate(images):
-                # Kép előfeldolgozása jobb OCR-hez
-                processed_image = self._preprocess_image(image)
-                
-                # OCR futtatása részletes adatokkal
-                ocr_data = pytesseract.image_to_data(
-                    processed_image,
-                    lang=self.ocr_languages,
-                    output_type=pytesseract.Output.DICT
-                )
-                
-                # Szavak csoportosítása sorokba
-                current_line = []
-                current_line_num = None
-                current_bbox = None
+            for page_num in range(len(doc)):
+                words = doc[page_num].get_text("words")
                 
-                for i in range(len(ocr_data["text"])):
-                    text = ocr_data["text"][i].strip()
-                    conf = float(ocr_data["conf"][i])
-                    line_num = ocr_data["line_num"][i]
+                # Egymást követő szavak csoportosítása (blokk, sor) szerint
+                for _, line_words in groupby(words, key=_WORD_LINE_KEY):
+                    line_words = list(line_words)
                     
-                    if not text or conf < 0:
-                        continue
+                    # Bounding box a sor szavainak befoglaló téglalapja
+                    bbox = BoundingBox(
+                        x0=min(word[0] for word in line_words),
+                        y0=min(word[1] for word in line_words),
+                        x1=max(word[2] for word in line_words),
+                        y1=max(word[3] for word in line_words),
+                        page=page_num
+                    )
                     
-                    # Új sor indítása
-                    if current_line_num is None or line_num != current_line_num:
-                        # Előző sor mentése
-                        if current_line:
-                            lines.append(StructuredLine(
-                                text=" ".join(current_line),
-                                bbox=current_bbox,
-                                source="ocr"
-                            ))
-                        
-                        # Új sor indítása
-                        current_line = [text]
-                        current_line_num = line_num
-                        current_bbox = BoundingBox(
-                            x0=ocr_data["left"][i],
-                            y0=ocr_data["top"][i],
-                            x1=ocr_data["left"][i] + ocr_data["width"][i],
-                            y1=ocr_data["top"][i] + ocr_data["height"][i],
-                            page=page_num
-                        )
-                    else:
-                        # Jelenlegi sor folytatása
-                        current_line.append(text)
-                        # Bbox kiterjesztése
-                        if current_bbox:
-                            current_bbox.x1 = ocr_data["left"][i] + ocr_data["width"][i]
-                
-                # Utolsó sor mentése
-                if current_line:
                     lines.append(StructuredLine(
-                        text=" ".join(current_line),
-                        bbox=current_bbox,
-                        source="ocr"
+                        text=" ".join(word[4] for word in line_words),
+                        bbox=bbox,
+                        source="pymupdf"
                     ))
         
         except Exception as e:
-            print(f"OCR extraction failed: {e}")
+            logger.warning("PyMuPDF extraction failed: %s", e)
+            return lines, False
+        
+        return lines, True
+    
+    async def _extract_with_ocr(
+        self,
+        doc: fitz.Document,
+        image_dir: Path
+    ) -> Tuple[List[StructuredLine], List[Path], bool]:
+        """
+        Szöveg kinyerése OCR-rel (Tesseract).
+        
+        Az első menet alacsonyabb DPI-vel fut (a Tesseract futásideje a
+        pixelszámmal nő); csak a gyenge minőségű oldalakat rendereljük és
+        OCR-ezzük újra a teljes DPI-vel.
+        
+        A Vision fallback nem az OCR szürkeárnyalatos (esetleg 200 DPI-s)
+        renderjeit kapja: az első oldalakról külön, színesen és teljes
+        DPI-vel készül kép - az OCR hibájától függetlenül is.
+        
+        Paraméterek:
+            doc: Megnyitott PyMuPDF dokumentum
+            image_dir: Könyvtár a Vision oldalképeknek
+        
+        Visszatérés:
+            Tuple (sorok, képfájlok, sikeres volt-e) - képek a Vision API fallback-hez
+        """
+        lines = []
+        ocr_ok = True
+        
+        try:
+            page_lines = {
+                page_num: _ocr_data_to_lines(ocr_data, page_num)
+                for page_num, ocr_data in await self._run_ocr_pipeline(
+                    doc, range(len(doc)), self.fast_image_dpi
+                )
+            }
+            
+            if self.fast_image_dpi < self.image_dpi:
+                # Az üres (szöveg nélküli) oldalakat nem ismételjük: nagyobb
+                # DPI-vel sem lesz rajtuk szöveg, csak egy második menetbe kerülnének
+                retry_pages = [
+                    page_num for page_num, ocr_lines in page_lines.items()
+                    if _char_count(ocr_lines) > 0 and self._is_low_quality_text(ocr_lines)
+                ]
+                if retry_pages:
+                    logger.info(
+                        "%d oldal újra-OCR-je %d DPI-vel", len(retry_pages), self.image_dpi
+                    )
+                    for page_num, ocr_data in await self._run_ocr_pipeline(
+                        doc, retry_pages, self.image_dpi
+                    ):
+                        retry_lines = _ocr_data_to_lines(ocr_data, page_num)
+                        # Csak akkor cseréljük, ha az új eredmény jobb
+                        if (
+                            not self._is_low_quality_text(retry_lines)
+                            or _char_count(retry_lines) > _char_count(page_lines[page_num])
+                        ):
+                            page_lines[page_num] = retry_lines
+            
+            logger.info("PDF OCR kész: %d oldal", len(page_lines))
+            
+            # Eredmények összefésülése oldalsorrendben
+            for page_num in sorted(page_lines):
+                lines.extend(page_lines[page_num])
+        
+        except Exception as e:
+            logger.warning("OCR extraction failed: %s", e)
+            ocr_ok = False
         
-        return lines, images
+        image_paths = await self._run_doc_thread(self._render_vision_pages, doc, image_dir)
+        # Hiányzó Vision oldalkép is hibának számít (a cache ne őrizze meg)
+        ocr_ok = ocr_ok and len(image_paths) == min(len(doc), VISION_PAGE_LIMIT)
+        
+        return lines, image_paths, ocr_ok
+    
+    async def _run_ocr_pipeline(
+        self,
+        doc: fitz.Document,
+        page_numbers: Sequence[int],
+        dpi: int
+    ) -> List[Tuple[int, Dict[str, list]]]:
+        """
+        A megadott oldalak OCR-je háromlépcsős pipeline-nal:
+        renderelés -> előfeldolgozás -> OCR.
+        
+        Az N+1. oldal renderelése átfed az N. oldal OCR-jével.
+        
+        Visszatérés:
+            (oldalszám, image_to_data dict) párok oldalsorrendben
+        """
+        render_queue = asyncio.Queue(maxsize=_PIPELINE_QUEUE_SIZE)
+        ocr_queue = asyncio.Queue(maxsize=_PIPELINE_QUEUE_SIZE)
+        tasks = [
+            asyncio.create_task(self._render_pages(doc, page_numbers, dpi, render_queue)),
+            asyncio.create_task(self._preprocess_pages(render_queue, ocr_queue)),
+            asyncio.create_task(self._ocr_pages(ocr_queue, len(page_numbers)))
+        ]
+        try:
+            _, _, ocr_results = await asyncio.gather(*tasks)
+        except BaseException:
+            # Egy lépcső hibája esetén a többi ne maradjon a sorra várva;
+            # a dokumentum bezárása előtt megvárjuk, hogy mind leálljon
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            raise
+        return ocr_results
+    
+    async def _render_pages(
+        self,
+        doc: fitz.Document,
+        page_numbers: Sequence[int],
+        dpi: int,
+        render_queue: asyncio.Queue
+    ) -> None:
+        """
+        Pipeline 1. lépcső: oldalak renderelése képpé PyMuPDF-fel (folyamaton belül).
+        
+        A renderelés szálban fut, hogy közben az event loop a többi lépcsőt
+        kiszolgálhassa; a dokumentumot egyszerre csak ez a szál használja.
+        """
+        for page_num in page_numbers:
+            image = await self._run_doc_thread(self._render_page, doc, page_num, dpi)
+            await render_queue.put((page_num, image))
+        await render_queue.put(None)
+    
+    async def _run_doc_thread(self, func: Callable[..., T], *args: Any) -> T:
+        """
+        A PyMuPDF dokumentumot használó függvény futtatása szálban.
+        
+        Megszakításkor a futó szálat megvárjuk, így a hívó utána
+        biztonságosan bezárhatja a dokumentumot.
+        """
+        work = asyncio.ensure_future(asyncio.to_thread(func, *args))
+        try:
+            return await asyncio.shield(work)
+        except asyncio.CancelledError:
+            await asyncio.gather(work, return_exceptions=True)
+            raise
+    
+    def _render_page(self, doc: fitz.Document, page_num: int, dpi: int) -> Image.Image:
+        """
+        Egy oldal renderelése szürkeárnyalatos PIL képpé a megadott DPI-vel.
+        
+        A szürke színtér harmadára csökkenti a pixeladatot, és az OCR
+        előtti színkonverzió is elmarad.
+        """
+        pixmap = doc[page_num].get_pixmap(dpi=dpi, colorspace=fitz.csGRAY)
+        return Image.frombytes("L", (pixmap.width, pixmap.height), pixmap.samples)
+    
+    def _render_vision_pages(self, doc: fitz.Document, image_dir: Path) -> List[Path]:
+        """
+        Az első oldalak renderelése színesen, teljes DPI-vel PNG fájlba a Vision fallback-hez.
+        
+        Visszatérés:
+            A sikeresen mentett képfájlok oldalsorrendben
+        """
+        image_paths = []
+        try:
+            for page_num in range(min(len(doc), VISION_PAGE_LIMIT)):
+                image_path = image_dir / f"page_{page_num}.png"
+                doc[page_num].get_pixmap(dpi=self.image_dpi).save(str(image_path))
+                image_paths.append(image_path)
+        except Exception as e:
+            logger.warning("Vision oldalkép renderelés sikertelen: %s", e)
+        return image_paths
+    
+    async def _preprocess_pages(
+        self,
+        render_queue: asyncio.Queue,
+        ocr_queue: asyncio.Queue
+    ) -> None:
+        """Pipeline 2. lépcső: renderelt oldalak előfeldolgozása OCR-hez."""
+        while (item := await render_queue.get()) is not None:
+            page_num, image = item
+            processed_image = await asyncio.to_thread(self._preprocess_image, image)
+            await ocr_queue.put((page_num, processed_image))
+        await ocr_queue.put(None)
+    
+    async def _ocr_pages(
+        self,
+        ocr_queue: asyncio.Queue,
+        page_total: int
+    ) -> List[Tuple[int, Dict[str, list]]]:
+        """
+        Pipeline 3. lépcső: előfeldolgozott oldalak OCR-je a folyamat poolban.
+        
+        Az oldalak blokkokban kerülnek a poolba: a blokkméret úgy van
+        megválasztva, hogy minden worker kapjon munkát, de egy blokk egyetlen
+        Tesseract indítással fusson le.
+        
+        Paraméterek:
+            ocr_queue: Előfeldolgozott oldalak sora
+            page_total: A sorba kerülő oldalak száma
+        
+        Visszatérés:
+            (oldalszám, image_to_data dict) párok oldalsorrendben
+        """
+        batch_size = min(-(-page_total // PROCESS_POOL_WORKERS), _OCR_BATCH_MAX_PAGES)
+        ocr_tasks = []
+        batch = []
+        
+        try:
+            while True:
+                item = await ocr_queue.get()
+                if item is not None:
+                    page_num, processed_image = item
+                    batch.append((
+                        page_num,
+                        processed_image.mode,
+                        processed_image.size,
+                        processed_image.tobytes()
+                    ))
+                
+                # Teli blokk vagy a sor vége: beküldés a poolba
+                if batch and (item is None or len(batch) >= batch_size):
+                    ocr_tasks.append(asyncio.create_task(run_in_process_pool(
+                        _ocr_page_batch,
+                        batch,
+                        self.ocr_languages
+                    )))
+                    batch = []
+                
+                if item is None:
+                    break
+            
+            # A gather megőrzi a beküldési (oldal) sorrendet
+            batch_results = await asyncio.gather(*ocr_tasks)
+        except BaseException:
+            # Hiba vagy megszakítás esetén a már beküldött blokkok se fussanak tovább
+            for task in ocr_tasks:
+                task.cancel()
+            await asyncio.gather(*ocr_tasks, return_exceptions=True)
+            raise
+        
+        return [page_result for results in batch_results for page_result in results]
     
     def _preprocess_image(self, image: Image.Image) -> Image.Image:
         """
@@ -371,10 +974,17 @@ class PDFProcessor:
         Visszatérés:
             Előfeldolgozott PIL kép
         """
-        # Szürkeárnyalatos konverzió
-        image = image.convert("L")
+        # Szürkeárnyalatos konverzió (a renderelt oldalak már "L" módúak)
+        if image.mode != "L":
+            image = image.convert("L")
         
-        return image
+        # Kontraszt kiterjesztése a teljes tartományra
+        image = ImageOps.autocontrast(image)
+        
+        # Binarizálás Otsu küszöbbel - az 1 bites képen a Tesseract
+        # kihagyja a saját küszöbölési lépését
+        threshold = _otsu_threshold(image.histogram())
+        return image.point(lambda p: 255 if p > threshold else 0, "1")
     
     def _is_low_quality_text(self, lines: List[StructuredLine]) -> bool:
         """
@@ -390,28 +1000,30 @@ class PDFProcessor:
             return True
         
         # Gyakori OCR artifaktok vagy értelmetlen szöveg ellenőrzése
-        total_chars = sum(len(line.text) for line in lines)
+        total_chars = _char_count(lines)
         if total_chars < 50:
             return True
         
-        # Túl sok speciális karakter ellenőrzése (sérülés jele)
-        special_char_count = sum(
-            1 for line in lines
-            for char in line.text
-            if not char.isalnum() and not char.isspace()
-        )
+        # Túl sok speciális karakter ellenőrzése (sérülés jele) - a számlálás
+        # egyetlen C-szintű regex menetben fut karakterenkénti Python ciklus helyett
+        joined = "".join(line.text for line in lines)
+        special_char_count = len(_SPECIAL_CHAR_RE.findall(joined))
         
         if total_chars > 0 and special_char_count / total_chars > 0.5:
             return True
         
         return False
     
-    def _count_pages(self, pdf_bytes: bytes) -> int:
-        """PDF oldalak számának meghatározása."""
+    def _open_fitz_document(self, pdf_bytes: bytes) -> Optional[fitz.Document]:
+        """PDF megnyitása PyMuPDF-fel (None ha a fájl nem nyitható meg)."""
         try:
-            doc = fitz.open(stream=pdf_bytes, filetype="pdf")
-            count = len(doc)
-            doc.close()
-            return count
-        except:
+            return fitz.open(stream=pdf_bytes, filetype="pdf")
+        except Exception as e:
+            logger.warning("PyMuPDF open failed: %s", e)
+            return None
+    
+    def _count_pages(self, doc: Optional[fitz.Document]) -> int:
+        """PDF oldalak számának meghatározása."""
+        if doc is None:
             return 1
+        return doc.page_count
@@ -0,0 +1,81 @@
+"""
+Közös folyamat pool a CPU-igényes munkákhoz (OCR, pdfplumber kinyerés).
+Ha egy worker elhal (OOM, összeomlás, nem visszaállítható kivétel), a pool
+eldobásra kerül és a következő hívás újat hoz létre.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Callable, Optional, TypeVar
+import asyncio
+import logging
+import multiprocessing
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Workerek száma (a szolgáltatás egy uvicorn workerrel fut)
+PROCESS_POOL_WORKERS = min(os.cpu_count() or 1, 4)
+
+_PROCESS_POOL: Optional[ProcessPoolExecutor] = None
+_PROCESS_POOL_LOCK = threading.Lock()
+
+
+def get_process_pool() -> ProcessPoolExecutor:
+    """
+    Folyamat pool lekérése (első használatkor, illetve eldobás után jön létre).
+
+    "spawn" indítási módot használunk: a szerver szálai (gRPC kliens,
+    naplózó) mellett a fork nem biztonságos.
+    """
+    global _PROCESS_POOL
+
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is None:
+            _PROCESS_POOL = ProcessPoolExecutor(
+                max_workers=PROCESS_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return _PROCESS_POOL
+
+
+def _discard_process_pool(pool: ProcessPoolExecutor) -> None:
+    """
+    Használhatatlanná vált pool eldobása.
+
+    Csak akkor nullázzuk, ha még ez az aktuális pool - így több egyidejű
+    hibázó hívás sem dob el egy közben már újonnan létrehozott poolt.
+    """
+    global _PROCESS_POOL
+
+    with _PROCESS_POOL_LOCK:
+        if _PROCESS_POOL is pool:
+            _PROCESS_POOL = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+async def run_in_process_pool(func: Callable[..., T], *args: Any) -> T:
+    """
+    Függvény futtatása a közös folyamat poolban.
+
+    Elhalt worker (BrokenProcessPool) esetén a poolt lecseréljük és a
+    munkát egyszer újrapróbáljuk; ha az is elbukik, a hiba továbbmegy,
+    de a következő hívás már friss poolt kap.
+    """
+    loop = asyncio.get_running_loop()
+
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool as e:
+        logger.warning("Folyamat pool használhatatlan, újraindítás: %s", e)
+        _discard_process_pool(pool)
+
+    pool = get_process_pool()
+    try:
+        return await loop.run_in_executor(pool, func, *args)
+    except BrokenProcessPool:
+        _discard_process_pool(pool)
+        raise
@@ -3,17 +3,31 @@ Eredmény validáló és utófeldolgozó modul.
 Validálja az LLM kimeneteket, alkalmaz üzleti szabályokat és biztosítja az adatminőséget.
 """
 import re
-from typing import Dict, Any, List, Optional
-from jsonschema import validate, ValidationError
+from typing import Any, Dict, Final, List, Optional
+from jsonschema import Draft7Validator, ValidationError
 
 from config import config
 
+# "nincs adat" variánsok és önálló kötőjelek - a gyakori pontos egyezéshez
+_NO_DATA_VALUES: Final = frozenset({
+    "nincs adat", "nincs", "n/a", "na", "not available",
+    "keine angabe", "non disponible", "-", "–", "—"
+})
+
+# Egyetlen menetben: "nincs adat" variáns az érték bármely részén ("nincs adat"
+# a "nincs"-ben benne van) VAGY (akár negatív) szám, számjegyek közötti
+# tizedesvesszővel (6,9)
+_VALUE_TOKEN_RE: Final = re.compile(
+    r'(?P<nd>nincs|n/a|na|not available|keine angabe|non disponible)'
+    r'|(?P<num>-?(?:\d+,\d+|[\d.])+)'
+)
+
 
 class ResultValidator:
     """Validálja és normalizálja a kinyert tápérték/allergén adatokat."""
     
     # JSON séma validáláshoz - illeszkedik az AI kimenet formátumhoz
-    SCHEMA = {
+    SCHEMA: Final[Dict[str, Any]] = {
         "type": "object",
         "properties": {
             "nutrition": {
@@ -71,6 +85,16 @@ class ResultValidator:
         "required": ["nutrition", "allergens"]
     }
     
+    # Előre felépített validátor - a séma ellenőrzése és a validátor
+    # összeállítása egyszer történik meg, nem minden hívásnál
+    Draft7Validator.check_schema(SCHEMA)
+    _VALIDATOR: Final = Draft7Validator(SCHEMA)
+    
+    @staticmethod
+    def is_valid(data: Any) -> bool:
+        """Illeszkedik-e az adat a sémához (kivétel nélkül, pl. cache ellenőrzéshez)."""
+        return ResultValidator._VALIDATOR.is_valid(data)
+    
     @staticmethod
     def validate_and_normalize(data: Dict[str, Any]) -> Dict[str, Any]:
         """
@@ -86,7 +110,7 @@ class ResultValidator:
             ValidationError: Ha az adat nem illeszkedik a sémához
         """
         # Séma validálás
-        validate(instance=data, schema=ResultValidator.SCHEMA)
+        ResultValidator._VALIDATOR.validate(data)
         
         # Tápérték értékek normalizálása (új nested formátum)
         if "nutrition" in data:
@@ -105,7 +129,7 @@ class ResultValidator:
         return data
     
     @staticmethod
-    def _normalize_value(value: str) -> str:
+    def _normalize_value(value: Optional[str]) -> Optional[str]:
         """
         Tápérték string normalizálása - csak a szám visszaadása egység nélkül.
         
@@ -120,44 +144,71 @@ class ResultValidator:
         
         value = value.strip().lower()
         
-        # "nincs adat" variánsok kezelése
-        no_data_patterns = [
-            "nincs adat", "nincs", "n/a", "na", "not available",
-            "keine angabe", "non disponible"
-        ]
-        if any(pattern in value for pattern in no_data_patterns):
-            return None
+        # Gyors út a tiszta számokra ("6.9", "6,9", "-5") - regex nélkül
+        number = ResultValidator._parse_plain_number(value)
+        if number is not None:
+            return ResultValidator._format_number(number)
         
-        # Önálló kötőjel ellenőrzése (számjegyek nélkül)
-        if value in ["-", "–", "—"] or (value.strip() in ["-", "–", "—"]):
+        # "nincs adat" variánsok és önálló kötőjel kezelése
+        if value in _NO_DATA_VALUES:
             return None
         
-        # Vessző pont-ra konvertálása számokban
-        value = re.sub(r'(\d+),(\d+)', r'\1.\2', value)
+        # Egy menet: bármely "nincs adat" találat -> None, különben az első szám
+        number_str = None
+        for match in _VALUE_TOKEN_RE.finditer(value):
+            if match.lastgroup == "nd":
+                return None
+            if number_str is None:
+                number_str = match.group("num")
         
-        # Csak a szám kinyerése (negatív számokat is beleértve)
-        match = re.search(r'(-?[\d.]+)', value)
-        if not match:
+        if number_str is None:
             return None
         
-        number_str = match.group(1)
-        
         try:
-            number = float(number_str)
-            
-            # Negatív értékek 0-ra csonkolása
-            if number < 0:
-                number = 0.0
-            
-            # Csak a szám visszaadása string-ként
-            if number == int(number):
-                return str(int(number))
-            else:
-                return f"{number:.1f}"
-        
+            # Vessző pont-ra konvertálása
+            return ResultValidator._format_number(float(number_str.replace(",", ".")))
         except ValueError:
             return None
     
+    @staticmethod
+    def _parse_plain_number(value: str) -> Optional[float]:
+        """
+        Csak számjegyekből, legfeljebb egy tizedesjelből és opcionális
+        előjelből álló érték gyors feldolgozása.
+        
+        Csak olyan alakot fogad el, amelyre a regex-es út ugyanazt adná;
+        minden mást (egység, szöveg, "1e3" stb.) None-nal a lassú útra enged.
+        """
+        digits = value[1:] if value[:1] == "-" else value
+        if not digits.isascii():
+            return None
+        
+        if digits.replace(".", "", 1).isdigit():
+            return float(value)
+        
+        # "6,9" alak: egyetlen vessző számjegyek között
+        if (
+            "." not in digits
+            and digits[:1] != ","
+            and digits[-1:] != ","
+            and digits.replace(",", "", 1).isdigit()
+        ):
+            return float(value.replace(",", ".", 1))
+        
+        return None
+    
+    @staticmethod
+    def _format_number(number: float) -> str:
+        """Szám formázása: negatív -> 0, egész -> egész, egyébként 1 tizedes."""
+        # Negatív értékek 0-ra csonkolása
+        if number < 0:
+            number = 0.0
+        
+        # Csak a szám visszaadása string-ként
+        if number == int(number):
+            return str(int(number))
+        return f"{number:.1f}"
+    
     @staticmethod
     def _normalize_allergens(allergens: List[str]) -> List[str]:
         """